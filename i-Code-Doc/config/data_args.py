@@ -104,6 +104,15 @@ class UdopDataArguments:
     image_size:int = field(
         default=224
     )
+    image_backend: str = field(
+        default='pil',
+        metadata={
+            'help':
+            'library used to decode page images, chosen in `["pil", "pyvips"]`. pyvips resizes bilevel scans '
+            'with antialiasing (grey pixels) where PIL keeps them binary, keep the same backend for training and '
+            'evaluation'
+        },
+    )
     use_line_tokens: bool = field(
         default=False
     )
@@ -23,6 +23,30 @@ class UdopTrainingArguments(TrainingArguments):
             '`DistributedDataParallel`.'
         },
     )
+    ddp_broadcast_buffers: Optional[bool] = field(
+        default=False,
+        metadata={
+            'help':
+            'When using distributed training, the value of the flag `broadcast_buffers` passed to '
+            '`DistributedDataParallel`. The UDOP models keep no buffers that need syncing across ranks.'
+        },
+    )
+    ddp_gradient_as_bucket_view: bool = field(
+        default=True,
+        metadata={
+            'help':
+            'When using distributed training, let gradients alias the all-reduce buckets of '
+            '`DistributedDataParallel` instead of being copied into them.'
+        },
+    )
+    ddp_static_graph: bool = field(
+        default=False,
+        metadata={
+            'help':
+            'When using distributed training, declare the graph static to `DistributedDataParallel` so it can '
+            'overlap more of the all-reduce with backward. Only valid if every step uses the same parameters.'
+        },
+    )
     profile: bool = field(default=False,
                           metadata={'help': 'whether to enable profiling'})
     optimizer: str = field(
@@ -37,10 +61,21 @@ class UdopTrainingArguments(TrainingArguments):
             'help': 'Set `True` to load training state (default: `False`)'
         })
 
-    prefetch_factor: int = field(default=2)
+    prefetch_factor: int = field(
+        default=4,
+        metadata={'help': 'Number of batches loaded in advance by each dataloader worker.'})
 
     dataloader_timeout: int = field(default=0)
 
+    dataloader_multiprocessing_context: Optional[str] = field(
+        default=None,
+        metadata={
+            'help':
+            'Start method of dataloader workers, chosen in `["fork", "forkserver", "spawn"]`. Defaults to the '
+            'platform default; `fork` shares the tokenizer and dataset index copy-on-write with the workers, the '
+            'other methods pickle them into each worker.'
+        })
+
     lr_fact: float = field(default=1.0)
 
     @cached_property
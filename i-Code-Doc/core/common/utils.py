@@ -62,17 +62,46 @@ class Normalize(object):
     
     
 def get_last_checkpoint(folder):
-    content = os.listdir(folder)
-    checkpoints = [
-        path for path in content if _re_checkpoint.search(path) is not None
-        and os.path.isdir(os.path.join(folder, path))
-    ]
-    if len(checkpoints) == 0:
+    # a single scandir pass, the directory check reuses the d_type from the listing instead of a stat per entry
+    last_step, last_checkpoint = -1, None
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.name.startswith(PREFIX_CHECKPOINT_DIR):
+                continue
+            match = _re_checkpoint.match(entry.name)
+            if match is None or not entry.is_dir():
+                continue
+            step = int(match.group(1))
+            if step > last_step:
+                last_step, last_checkpoint = step, entry.name
+    if last_checkpoint is None:
         return
-    return os.path.join(
-        folder,
-        max(checkpoints,
-            key=lambda x: int(_re_checkpoint.search(x).groups()[0])))
+    return os.path.join(folder, last_checkpoint)
+
+
+def compile_blocks(model, block_types, shape_variants=2):
+    """Compiles the forward of every submodule that is an instance of `block_types`, leaving the rest eager.
+
+    The compiled function is installed on the module itself so parameter names and checkpoints are unchanged.
+    Graphs are specialized to static shapes, so inputs should be padded to a fixed length; `shape_variants` is the
+    number of distinct input shapes (or train/eval modes) each block is expected to see.
+    """
+    if not hasattr(torch, 'compile'):
+        raise RuntimeError('Compiling transformer blocks requires torch>=2.0')
+    import torch._dynamo
+
+    blocks = [module for module in model.modules() if isinstance(module, block_types)]
+    # every block shares the forward code object but guards on its own instance, keep one cache
+    # entry per block and shape variant instead of silently falling back to eager once the limit is hit
+    n_entries = shape_variants * len(blocks)
+    dynamo_config = torch._dynamo.config
+    dynamo_config.cache_size_limit = max(dynamo_config.cache_size_limit, n_entries)
+    if hasattr(dynamo_config, 'accumulated_cache_size_limit'):
+        dynamo_config.accumulated_cache_size_limit = max(dynamo_config.accumulated_cache_size_limit, n_entries)
+    for module in blocks:
+        module.forward = torch.compile(module.forward, dynamic=False)
+    logger.info(f'Compiled {len(blocks)} transformer blocks')
+    return model
 
 
 def clamp(num, min_value, max_value):
@@ -6,6 +6,7 @@ import random
 from tqdm import tqdm
 from PIL import Image
 
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 
@@ -14,6 +15,7 @@ from core.datasets.collate_supervised import DataCollatorForT5DocCLS
 
 EMPTY_BOX = [0, 0, 0, 0]
 SEP_BOX = [1000, 1000, 1000, 1000]
+TOKEN_CACHE_SIZE = 1 << 18
 
 logger = logging.getLogger(__name__)
 
@@ -123,6 +125,17 @@ class RvlCdipDataset(Dataset):
         self.label_list = label_list
 
         self.image_size = data_args.image_size
+        self.image_backend = data_args.image_backend
+        # word -> sub tokens, filled per dataloader worker
+        self.token_cache = {}
+        if self.image_backend not in ('pil', 'pyvips'):
+            raise ValueError(f'Unsupported image backend {self.image_backend}, choose from `pil` or `pyvips`')
+        if self.image_backend == 'pyvips':
+            # fail here, `__getitem__` swallows errors and moves on to the next sample
+            try:
+                import pyvips  # noqa: F401
+            except ImportError:
+                raise ImportError('`--image_backend pyvips` requires pyvips: `pip install pyvips`.')
         
         self.examples = []
         self.labels = []
@@ -166,7 +179,7 @@ class RvlCdipDataset(Dataset):
             label = self.labels[index]
             label = self.label_map[int(label)]
 
-            rets, n_split = read_ocr_core_engine(self.examples[index], self.images[index], self.tokenizer, self.max_seq_length, self.num_img_embeds, self.image_size)
+            rets, n_split = read_ocr_core_engine(self.examples[index], self.images[index], self.tokenizer, self.max_seq_length, self.num_img_embeds, self.image_size, self.image_backend, self.token_cache)
             if n_split == 0:
                 # Something wrong with the .ocr.json file
                 print("EMPTY ENTRY")
@@ -246,7 +259,26 @@ class RvlCdipDataset(Dataset):
 
     
 # Might need to change to your own OCR processing
-def read_ocr_core_engine(file, image_dir, tokenizer, max_seq_length, num_img_embeds, image_size):
+def load_tiff_page(image_path, page, image_size, backend='pil'):
+    if backend == 'pyvips':
+        # libvips shrinks while decoding instead of materializing the full resolution scan first. Unlike PIL,
+        # which resizes bilevel (mode "1") scans with nearest neighbour, this gives antialiased grey pixels
+        import pyvips
+        vips_image = pyvips.Image.thumbnail(f'{image_path}[page={page}]', image_size, height=image_size, size='force')
+        if vips_image.format != 'uchar':
+            vips_image = vips_image.cast('uchar')
+        array = np.ndarray(buffer=vips_image.write_to_memory(), dtype=np.uint8,
+                           shape=[vips_image.height, vips_image.width, vips_image.bands])
+        if vips_image.bands == 1:
+            array = array[:, :, 0]
+        return img_trans_torchvision(Image.fromarray(array), image_size)
+
+    tiff_images = Image.open(image_path)
+    tiff_images.seek(page)
+    return img_trans_torchvision(tiff_images, image_size)
+
+
+def read_ocr_core_engine(file, image_dir, tokenizer, max_seq_length, num_img_embeds, image_size, image_backend='pil', token_cache=None):
     with open(file, 'r', encoding='utf8') as f:
         try:
             data = json.load(f)
@@ -258,26 +290,30 @@ def read_ocr_core_engine(file, image_dir, tokenizer, max_seq_length, num_img_emb
     if 'analyzeResult' not in data or 'readResults' not in data['analyzeResult']:
         return rets, n_split
 
-    tiff_images = Image.open(image_dir)
-
     doc = data['analyzeResult']['readResults']
     
-    pid = random.choice(list(range(len(doc))))
+    pid = random.randrange(len(doc))
     page = doc[pid]
     text_list, bbox_list = [], []
     lines = page['lines']
     height, width = float(page['height']), float(page['width'])
     page_size = (width, height)
 
-    tiff_images.seek(pid)
-    image = img_trans_torchvision(tiff_images, image_size)
+    image = load_tiff_page(image_dir, pid, image_size, image_backend)
     for cnt, line in enumerate(lines):
         for j, word in enumerate(line["words"]):
             text = normalText(word['text'])
             if text == '':
                 continue
             bb = get_bb(word['boundingBox'])
-            sub_tokens = tokenizer.tokenize(text)
+            if token_cache is None:
+                sub_tokens = tokenizer.tokenize(text)
+            else:
+                sub_tokens = token_cache.get(text)
+                if sub_tokens is None:
+                    if len(token_cache) >= TOKEN_CACHE_SIZE:
+                        token_cache.clear()
+                    sub_tokens = token_cache[text] = tokenizer.tokenize(text)
             for sub_token in sub_tokens:
                 text_list.append(sub_token)
                 bbox_list.append(bb)
@@ -13,12 +13,18 @@ from functools import partial
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
+from packaging import version
 from timm.models.vision_transformer import PatchEmbed, DropPath
 
 from core.models.mae.pos_embed import get_2d_sincos_pos_embed
 from core.models.embedding.cell_embed import CellEmbeddings
 
+# `scale` argument of scaled_dot_product_attention was added in torch 2.1
+_SDPA_SUPPORTS_SCALE = version.parse(version.parse(torch.__version__).base_version) >= version.parse('2.1.0')
+
+
 class Mlp(nn.Module):
     def __init__(self, in_features, hidden_features=None, out_features=None, act_layer=nn.GELU, drop=0.):
         super().__init__()
@@ -36,7 +42,25 @@ class Mlp(nn.Module):
         x = self.fc2(x)
         x = self.drop(x)
         return x
-    
+
+
+def attention(q, k, v, scale, attn_drop):
+    # fused flash / memory efficient kernels never materialize the attention matrix, available from torch 2.0
+    if hasattr(F, 'scaled_dot_product_attention'):
+        dropout_p = attn_drop.p if attn_drop.training else 0.
+        if _SDPA_SUPPORTS_SCALE:
+            return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, scale=scale)
+        # torch 2.0 always scales by head_dim ** -0.5, fold a custom qk_scale into q
+        if scale != q.shape[-1] ** -0.5:
+            q = q * (scale * q.shape[-1] ** 0.5)
+        return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+
+    attn = (q @ k.transpose(-2, -1)) * scale
+    attn = attn.softmax(dim=-1)
+    attn = attn_drop(attn)
+    return attn @ v
+
+
 class Attention(nn.Module):
     def __init__(self, dim, num_heads=8, qkv_bias=False, qk_scale=None, attn_drop=0., proj_drop=0.):
         super().__init__()
@@ -55,11 +79,7 @@ class Attention(nn.Module):
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]   # make torchscript happy (cannot use tensor as tuple)
 
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+        x = attention(q, k, v, self.scale, self.attn_drop).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -89,11 +109,7 @@ class CrossAttention(nn.Module):
         k = self.k(context).reshape(B, N_context, self.num_heads, C // self.num_heads).permute(0, 2, 1, 3)
         v = self.v(context).reshape(B, N_context, self.num_heads, C // self.num_heads).permute(0, 2, 1, 3)
 
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+        x = attention(q, k, v, self.scale, self.attn_drop).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
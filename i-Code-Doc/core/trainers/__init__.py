@@ -1,2 +1,2 @@
-from .trainer import PretrainTrainer
+from .trainer import PretrainTrainer, configure_ddp_handler
 from .data_collator import DataCollator
\ No newline at end of file
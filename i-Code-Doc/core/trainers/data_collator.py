@@ -8,16 +8,18 @@ from transformers.tokenization_utils_base import PaddingStrategy
 from transformers.tokenization_utils_fast import PreTrainedTokenizerFast
 
 
-def pad_sequence_native(seq, target_len, pad_value=0, dtype=torch.int):
-    if isinstance(seq, torch.Tensor):
-        n = seq.shape[0]
-    else:
-        n = len(seq)
-        seq = torch.tensor(seq, dtype=dtype)
-    m = target_len - n
-    ret = torch.tensor([pad_value] * m, dtype=seq.dtype)
-    ret = torch.cat([seq, ret], dim=0)[:target_len]
-    return ret
+def pad_batch_native(seqs, target_len, pad_value=0, dtype=torch.int):
+    """Pads or truncates each of `seqs` to `target_len` with `pad_value` and stacks them along a new batch dim.
+
+    The output is allocated once and filled with slice copies.
+    """
+    seqs = [seq if isinstance(seq, torch.Tensor) else torch.tensor(seq, dtype=dtype) for seq in seqs]
+    batched = torch.empty((len(seqs), target_len) + tuple(seqs[0].shape[1:]), dtype=seqs[0].dtype)
+    batched[:] = torch.tensor(pad_value, dtype=seqs[0].dtype)
+    for i, seq in enumerate(seqs):
+        n = min(seq.shape[0], target_len)
+        batched[i, :n] = seq[:n]
+    return batched
 
 
 def random_masking(L=4096, mask_ratio=0.75):
@@ -67,10 +69,16 @@ class DataCollator:
         max_feature_len = max([f["input_ids"].shape[0] for f in features])
         max_feature_len_decoder = max([f["labels"].shape[0] for f in features])
         
+        # with `max_length` padding every batch has the same shapes, regardless of its longest sample
+        pad_to_max_length = self.padding == PaddingStrategy.MAX_LENGTH
+        if pad_to_max_length:
+            max_feature_len, max_feature_len_decoder = max_len, max_len_decoder
+
         target_len = min(max_feature_len, max_len)
         target_len_decoder = min(max_feature_len_decoder, max_len_decoder)
         # if features[0]["char_ids"] is not None:
         if "char_ids" in features[0]:
+            # char features stay on dynamic padding, datasets only emit a placeholder character so far
             max_feature_len_char = max([f["char_ids"].shape[0] for f in features])
             target_len_char = min(max_feature_len_char, max_len_char)
 
@@ -85,13 +93,13 @@ class DataCollator:
                 continue
 
             if key in ['decoder_input_ids', 'labels', 'decoder_attention_mask', 'decoder_seg_data']:
-                batched_feature = torch.stack([pad_sequence_native(f[key], target_len_decoder, pad_value) for f in features], dim=0)
+                batched_feature = pad_batch_native([f[key] for f in features], target_len_decoder, pad_value)
             elif key == "visual_seg_data":
                 batched_feature = torch.stack([f[key] for f in features], dim=0)    
             elif key in ['char_ids', 'char_seg_data']:
-                batched_feature = torch.stack([pad_sequence_native(f[key], target_len_char, pad_value) for f in features], dim=0)
+                batched_feature = pad_batch_native([f[key] for f in features], target_len_char, pad_value)
             else:
-                batched_feature = torch.stack([pad_sequence_native(f[key], target_len, pad_value) for f in features], dim=0)
+                batched_feature = pad_batch_native([f[key] for f in features], target_len, pad_value)
             batch[key] = batched_feature
 
         if "position_ids" not in batch:
@@ -99,7 +107,7 @@ class DataCollator:
             batch["position_ids"] = position_ids
         
         if 'image' in features[0]:
-            image_list = torch.stack([d['image'] for d in features])
+            image_list = torch.stack([d['image'] for d in features]).contiguous(memory_format=torch.channels_last)
             batch.update({'image': image_list})
             
             for k in ['image_mask_label']:
@@ -57,6 +57,20 @@ def save_visualize_mae(image_output_, image_target, image_mask_label=None, outpu
         Image.fromarray(im_o_masked).save(os.path.join(save_dir, f'output_masked_{str(k)}.jpg'))
     
     
+def configure_ddp_handler(accelerator, args):
+    """Forwards the DDP options of `args` that transformers does not pass itself to the accelerate DDP handler.
+
+    DDP is only built later by `accelerator.prepare`, the handler is unset when not training distributed.
+    """
+    ddp_handler = getattr(accelerator, 'ddp_handler', None)
+    if ddp_handler is None:
+        return
+    ddp_handler.gradient_as_bucket_view = args.ddp_gradient_as_bucket_view
+    ddp_handler.static_graph = args.ddp_static_graph
+    if args.ddp_broadcast_buffers is not None:
+        ddp_handler.broadcast_buffers = args.ddp_broadcast_buffers
+
+
 class PretrainTrainer(transformers.trainer.Trainer):
     
     def __init__(self, **kwargs):
@@ -112,6 +126,13 @@ class PretrainTrainer(transformers.trainer.Trainer):
 
         train_sampler = self._get_train_sampler()
 
+        # prefetching is only valid with worker processes
+        worker_kwargs = {}
+        if self.args.dataloader_num_workers > 0:
+            worker_kwargs['prefetch_factor'] = getattr(self.args, 'prefetch_factor', 2)
+            worker_kwargs['timeout'] = getattr(self.args, 'dataloader_timeout', 0)
+            worker_kwargs['multiprocessing_context'] = getattr(self.args, 'dataloader_multiprocessing_context', None)
+
         loaders = {}
         for key in self.train_dataset:
             loaders[key] = DataLoader(
@@ -122,12 +143,23 @@ class PretrainTrainer(transformers.trainer.Trainer):
                                 drop_last=self.args.dataloader_drop_last,
                                 num_workers=self.args.dataloader_num_workers,
                                 pin_memory=self.args.dataloader_pin_memory,
+                                persistent_workers=self.args.dataloader_num_workers > 0,
                                 worker_init_fn=seed_worker,
+                                **worker_kwargs,
                             )
         combined_loader = CombinedLoader(loaders, mode="max_size_cycle")
 
         return combined_loader
 
+    def _prepare_input(self, data: Union[torch.Tensor, Any]) -> Union[torch.Tensor, Any]:
+        """
+        Batches come out of pinned memory, so the host to device copies are issued asynchronously.
+        Containers and the DeepSpeed dtype handling are left to the upstream implementation.
+        """
+        if isinstance(data, torch.Tensor) and not getattr(self, 'is_deepspeed_enabled', False):
+            return data.to(device=self.args.device, non_blocking=self.args.dataloader_pin_memory)
+        return super()._prepare_input(data)
+
     def training_step(self, model: nn.Module, inputs: Dict[str, Union[torch.Tensor, Any]]) -> torch.Tensor:
         """
         Perform a training step on a batch of inputs.
@@ -167,6 +199,12 @@ class PretrainTrainer(transformers.trainer.Trainer):
         return loss.detach()
 
     
+    def _wrap_model(self, model, training=True, dataloader=None):
+        model = super()._wrap_model(model, training=training, dataloader=dataloader)
+        if training:
+            configure_ddp_handler(self.accelerator, self.args)
+        return model
+
     def _save_checkpoint(self, model, trial, metrics=None):
         # In all cases, including ddp/dp/deepspeed, self.model is always a reference to the model we
         # want to save except FullyShardedDDP.
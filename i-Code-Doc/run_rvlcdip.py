@@ -8,6 +8,9 @@ from dataclasses import dataclass, field
 from typing import Optional
 
 import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from packaging import version
 from datasets import ClassLabel, load_dataset, load_metric
 
 import transformers
@@ -21,11 +24,13 @@ from transformers import (
     Trainer, 
     set_seed,
 )
-from transformers.trainer_utils import get_last_checkpoint, is_main_process
+from transformers.models.t5.modeling_t5 import T5Block
+from transformers.trainer_utils import is_main_process, seed_worker
 from transformers.utils import check_min_version
 
+from core.common.utils import compile_blocks, get_last_checkpoint
 from core.datasets import RvlCdipDataset, get_rvlcdip_labels
-from core.trainers import DataCollator
+from core.trainers import DataCollator, configure_ddp_handler
 from core.models import UdopDualForConditionalGeneration, UdopUnimodelForConditionalGeneration, UdopConfig, UdopTokenizer
 
 
@@ -109,6 +114,12 @@ class DataTrainingArguments:
         "value if set."
     },
     )
+    image_backend: str = field(
+        default="pil",
+        metadata={"help": "Library used to decode page images. Choices: pil (default) or pyvips. pyvips resizes "
+                  "bilevel scans with antialiasing (grey pixels) where PIL keeps them binary, so do not switch "
+                  "backends between training and evaluation of a model."},
+    )
     max_seq_length: int = field(
         default=512,
         metadata={
@@ -163,13 +174,135 @@ class ModelArguments:
         default="original_full",
         metadata={"help": "Attention type: BigBird configuruation only. Choices: block_sparse (default) or original_full"},
     )
+    compile_blocks: bool = field(
+        default=False,
+        metadata={"help": "Compile only the T5 transformer blocks with torch.compile instead of the whole model. "
+                  "Requires --pad_to_max_length so that the compiled graphs see static shapes."},
+    )
+
+
+@dataclass
+class RvlCdipTrainingArguments(TrainingArguments):
+    """
+    Training arguments extended with the dataloader and performance options used by this script.
+    """
+    optim: str = field(
+        default="adamw_torch_fused",
+        metadata={
+            "help": "The optimizer to use. Defaults to the fused torch AdamW, which updates all parameters in a "
+            "single kernel; falls back to `adamw_torch` where it is not available."
+        },
+    )
+    prefetch_factor: int = field(
+        default=4,
+        metadata={"help": "Number of batches loaded in advance by each dataloader worker."},
+    )
+    effective_batch_size: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "Target global batch size. If set, `gradient_accumulation_steps` is derived from it so that the "
+            "DDP all-reduce is amortized over several micro-batches."
+        },
+    )
+    ddp_broadcast_buffers: Optional[bool] = field(
+        default=False,
+        metadata={
+            "help": "When using distributed training, the value of the flag `broadcast_buffers` passed to "
+            "`DistributedDataParallel`. The UDOP models keep no buffers that need syncing across ranks."
+        },
+    )
+    ddp_gradient_as_bucket_view: bool = field(
+        default=True,
+        metadata={
+            "help": "When using distributed training, let gradients alias the all-reduce buckets of "
+            "`DistributedDataParallel` instead of being copied into them."
+        },
+    )
+    ddp_static_graph: bool = field(
+        default=False,
+        metadata={
+            "help": "When using distributed training, declare the graph static to `DistributedDataParallel` so it "
+            "can overlap more of the all-reduce with backward. Only valid if every step uses the same parameters."
+        },
+    )
+    prefer_bf16: bool = field(
+        default=True,
+        metadata={
+            "help": "Run `--fp16` requests as native bf16 autocast on Ampere and newer GPUs. fp16 with loss scaling "
+            "is kept as the fallback for older GPUs."
+        },
+    )
+
+    def __post_init__(self):
+        # `fp16_backend` is deprecated but still copied into `half_precision_backend` by the parent
+        if "apex" in (self.half_precision_backend, self.fp16_backend):
+            logger.warning("apex AMP is deprecated, falling back to native torch.cuda.amp")
+            self.half_precision_backend = "auto"
+            self.fp16_backend = "auto"
+        # `torch.cuda.is_bf16_supported` also reports emulated bf16 on older GPUs, check for Ampere instead
+        if (self.fp16 and self.prefer_bf16 and not self.no_cuda
+                and torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8):
+            logger.info("bf16 is supported on this device, using bf16 instead of fp16")
+            self.fp16 = False
+            self.bf16 = True
+        if self.optim == "adamw_torch_fused":
+            # fused AdamW needs CUDA tensors and torch>=2.0, and transformers rejects it with fp16 on torch 2.0.0
+            torch_version = version.parse(version.parse(torch.__version__).base_version)
+            if (self.no_cuda or not torch.cuda.is_available() or torch_version < version.parse("2.0.0")
+                    or (self.fp16 and torch_version == version.parse("2.0.0"))):
+                self.optim = "adamw_torch"
+        # set before the parent copies the mode into ACCELERATE_DYNAMO_MODE
+        if self.torch_compile and self.torch_compile_mode is None:
+            # let inductor autotune the fused LayerNorm/residual/GELU kernels, the model is memory bound there
+            self.torch_compile_mode = "max-autotune"
+        super().__post_init__()
+
+
+class RvlCdipTrainer(Trainer):
+    """
+    Trainer that keeps dataloader workers alive across epochs and copies pinned batches to the device asynchronously.
+    """
+
+    def get_train_dataloader(self) -> DataLoader:
+        if self.train_dataset is None:
+            raise ValueError("Trainer: training requires a train_dataset.")
+
+        # worker options are only valid with worker processes
+        worker_kwargs = {}
+        if self.args.dataloader_num_workers > 0:
+            worker_kwargs["persistent_workers"] = True
+            worker_kwargs["prefetch_factor"] = self.args.prefetch_factor
+
+        train_dataloader = DataLoader(
+            self.train_dataset,
+            batch_size=self._train_batch_size,
+            sampler=self._get_train_sampler(),
+            collate_fn=self._get_collator_with_removed_columns(self.data_collator, description="training"),
+            drop_last=self.args.dataloader_drop_last,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            worker_init_fn=seed_worker,
+            **worker_kwargs,
+        )
+        return self.accelerator.prepare(train_dataloader)
+
+    def _wrap_model(self, model, training=True, dataloader=None):
+        model = super()._wrap_model(model, training=training, dataloader=dataloader)
+        if training:
+            configure_ddp_handler(self.accelerator, self.args)
+        return model
+
+    def _prepare_input(self, data):
+        if isinstance(data, torch.Tensor) and not self.is_deepspeed_enabled:
+            return data.to(device=self.args.device, non_blocking=self.args.dataloader_pin_memory)
+        return super()._prepare_input(data)
 
 
 def main():
     # See all possible arguments in layoutlmft/transformers/training_args.py
     # or by passing the --help flag to this script.
     # We now keep distinct sets of args, for a cleaner separation of concerns.
-    parser = HfArgumentParser((ModelArguments, DataTrainingArguments, TrainingArguments))
+    parser = HfArgumentParser((ModelArguments, DataTrainingArguments, RvlCdipTrainingArguments))
     if len(sys.argv) == 2 and sys.argv[1].endswith(".json"):
         # If we pass only one argument to the script and it's the path to a json file,
         # let's parse it to get our arguments.
@@ -178,6 +311,19 @@ def main():
         model_args, data_args, training_args = parser.parse_args_into_dataclasses()
 
     training_args.logging_dir = os.path.join(training_args.output_dir, 'runs')
+    # OCR parsing and image decoding happen in `__getitem__`, keep several workers decoding ahead of the GPU
+    training_args.dataloader_num_workers = max(training_args.dataloader_num_workers, 4)
+    if training_args.effective_batch_size is not None:
+        if training_args.gradient_accumulation_steps != 1:
+            raise ValueError("`--effective_batch_size` and `--gradient_accumulation_steps` are mutually exclusive.")
+        step_batch_size = training_args.train_batch_size * training_args.world_size
+        training_args.gradient_accumulation_steps = max(1, training_args.effective_batch_size // step_batch_size)
+        if training_args.effective_batch_size % step_batch_size != 0:
+            logger.warning(
+                f"effective_batch_size {training_args.effective_batch_size} is not divisible by the per step batch "
+                f"size {step_batch_size}, training with an effective batch size of "
+                f"{training_args.gradient_accumulation_steps * step_batch_size} instead"
+            )
     if model_args.cache_dir is None:
         model_args.cache_dir = os.path.join(training_args.output_dir, 'cache')
     os.makedirs(model_args.cache_dir, exist_ok=True)
@@ -261,6 +407,17 @@ def main():
         revision=model_args.model_revision,
         use_auth_token=True if model_args.use_auth_token else None,
     )
+    # NHWC layout lets the patch embedding conv of the image encoder run on Tensor Cores under AMP
+    model = model.to(memory_format=torch.channels_last)
+    if model_args.compile_blocks:
+        if training_args.torch_compile:
+            raise ValueError("`--compile_blocks` and `--torch_compile` are mutually exclusive.")
+        if not data_args.pad_to_max_length:
+            raise ValueError("`--compile_blocks` requires `--pad_to_max_length`, dynamic padding recompiles every batch.")
+        # MAE blocks are left eager, the number of kept patches changes with the random mask ratio.
+        # Each block sees the full train and eval batches, plus the partial last batches unless they are dropped
+        shape_variants = 2 if training_args.dataloader_drop_last else 4
+        model = compile_blocks(model, T5Block, shape_variants=shape_variants)
 
    # Get datasets
     train_dataset = (RvlCdipDataset(data_args=data_args, tokenizer=tokenizer, mode='train')
@@ -285,7 +442,7 @@ def main():
         return metric.compute(predictions=predictions, references=labels)
 
     # Initialize our Trainer
-    trainer = Trainer(
+    trainer = RvlCdipTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset if training_args.do_train else None,